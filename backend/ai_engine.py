@@ -5,16 +5,53 @@ Unterstützt OpenRouter (Cloud) UND Ollama (Lokal via VPN).
 """
 
 import os
-import json
 import time
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import sys
 import threading
+import logging
 import ast
+from json_utils import json_loads
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Prompt-Vorlage für das Test-Feedback: einmal beim Import angelegt, pro Aufruf nur format_map
+_FEEDBACK_PROMPT = """
+    Du bist ein energetischer, cooler Lern-Coach für Schüler. 
+    Deine Mission: MOTIVATION PUR! 🚀
+    
+    Analysiere dieses Testergebnis. Sei nicht langweilig! Sei wie ein YouTuber oder Sport-Coach.
+    Sprich den Schüler direkt mit "Du" an. Nutze viele Emojis.
+
+    DATEN:
+    Fach: {subject}
+    Thema: {topic}
+    Ergebnis: {score}% ({correct} von {total} richtig)
+
+    DEINE AUFGABE:
+    Antworte STRENG als JSON:
+    {{
+        "overall_assessment": "Dein motivierendes Fazit (kurz & knackig)",
+        "key_strengths": ["Stärke 1", "Stärke 2"],
+        "main_weaknesses": ["Hier kannst du noch punkten 1", "Hier leveln wir noch hoch 2"], 
+        "learning_recommendations": [
+            {{
+                "priority": "hoch/mittel/niedrig",
+                "area": "Was genau?",
+                "action": "Konkreter Tipp", 
+                "reason": "Warum hilft das?"
+            }}
+        ],
+        "conceptual_understanding": "Einschätzung (z.B. 'Grundlagen sitzen')",
+        "next_steps": ["Schritt 1", "Schritt 2"],
+        "encouragement": "Dein finaler Motivations-Spruch"
+    }}
+    """
+
 class AIEngine:
     def __init__(self):
         # Wir lesen aus der .env, ob wir CLOUD oder LOCAL wollen
@@ -42,17 +79,27 @@ class AIEngine:
             self.base_url = "https://openrouter.ai/api/v1/chat/completions"
             self.model = "tngtech/deepseek-r1t2-chimera:free"
 
+        # Eine Session für alle Anfragen: Keep-Alive spart TCP/TLS-Handshake pro KI-Aufruf.
+        # Pool groß genug für parallele Feedback-Threads.
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self._http.mount("https://", adapter)
+        self._http.mount("http://", adapter)
+        # Header sind für alle Anfragen gleich -> einmal an der Session statt pro Aufruf
+        self._http.headers.update({"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"})
+
+        # Ladebalken nur im Terminal: ohne TTY (Server, Log-Datei) kein Extra-Thread und keine stdout-Writes
+        self._show_spinner = sys.stdout.isatty()
+
         print(f"🤖 KI-Engine geladen: {self.model} via {self.mode.upper()}")
 
     def _robust_api_call(self, prompt, max_retries=2, response_format="text", timeout=60):
         """Robust Request mit System-Prompt und aggressivem JSON-Fixing"""
         
         if not self.api_key and self.mode == "cloud":
-            print("❌ Kein API-Key")
+            logger.error("❌ Kein API-Key")
             return None
             
-        headers = { "Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json" }
-        
         # 1. SYSTEM PROMPT: Macht das Modell "gehorsam"
         messages = [
             {"role": "system", "content": "You are a strict JSON generator. Output ONLY valid JSON. No markdown, no intro text, no explanations."},
@@ -62,13 +109,13 @@ class AIEngine:
         data = {
             "model": self.model,
             "messages": messages,
-            "temperature": 0.5 # Etwas kreativer als 0, aber strikter als 0.7
+            "temperature": 0.5, # Etwas kreativer als 0, aber strikter als 0.7
+            "stream": True # Tokens kommen als SSE-Stream, statt auf die komplette Antwort zu warten
         }
 
         if response_format == "json":
             if self.mode == "local":
                 data["format"] = "json"
-                data["stream"] = False
             else:
                 data["response_format"] = {"type": "json_object"}
 
@@ -79,76 +126,100 @@ class AIEngine:
                 # --- LADEBALKEN ---
                 start_time = time.time()
                 stop_loading = threading.Event()
-                def loader():
-                    chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
-                    i = 0
-                    while not stop_loading.is_set():
-                        sys.stdout.write(f"\r{chars[i]} KI arbeitet... ({time.time()-start_time:.1f}s)")
-                        sys.stdout.flush()
-                        time.sleep(0.1)
-                        i = (i + 1) % len(chars)
-                
-                t = threading.Thread(target=loader)
-                t.daemon = True
-                t.start()
+                t = None
+                if self._show_spinner:
+                    def loader():
+                        chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
+                        i = 0
+                        while not stop_loading.is_set():
+                            sys.stdout.write(f"\r{chars[i]} KI arbeitet... ({time.time()-start_time:.1f}s)")
+                            sys.stdout.flush()
+                            time.sleep(0.1)
+                            i = (i + 1) % len(chars)
+                    
+                    t = threading.Thread(target=loader)
+                    t.daemon = True
+                    t.start()
                 
                 # REQUEST
-                resp = requests.post(self.base_url, headers=headers, json=data, timeout=current_timeout)
-                
-                stop_loading.set()
-                t.join()
-                
-                if resp.status_code == 200:
-                    result_json = resp.json()
-                    content = result_json['choices'][0]['message']['content']
+                # stream=True: timeout gilt nur pro Lesevorgang -> Gesamt-Deadline prüft _iter_stream_content.
+                # with schließt die Antwort auch bei Fehlern/Abbruch, damit keine Verbindung hängen bleibt
+                with self._http.post(self.base_url, json=data, timeout=current_timeout, stream=True) as resp:
+                    if resp.status_code == 200:
+                        content = "".join(self._iter_stream_content(resp, start_time + current_timeout))
+                        stop_loading.set()
+                        if t: t.join()
                     
-                    # Statistik (nur für Terminal-Show)
-                    duration = time.time() - start_time
-                    tps = (len(content)/3.5) / duration
-                    sys.stdout.write(f"\r🚀 FERTIG: {duration:.2f}s | {self.mode} | {tps:.1f} T/s\n")
+                        # Statistik (im Terminal als Zeile, sonst nur im Log)
+                        duration = time.time() - start_time
+                        tps = (len(content)/3.5) / duration
+                        if t:
+                            sys.stdout.write(f"\r🚀 FERTIG: {duration:.2f}s | {self.mode} | {tps:.1f} T/s\n")
+                        else:
+                            logger.info("🚀 FERTIG: %.2fs | %s | %.1f T/s", duration, self.mode, tps)
                     
-                    if response_format == "json":
-                        # === AGGRESSIVE REINIGUNG ===
-                        # 1. Markdown entfernen
-                        clean_content = content.replace("```json", "").replace("```", "").strip()
+                        if response_format == "json":
+                            # === AGGRESSIVE REINIGUNG ===
+                            # 1. Markdown entfernen
+                            clean_content = content.replace("```json", "").replace("```", "").strip()
                         
-                        try:
-                            # Versuch 1: Normales JSON
-                            return json.loads(clean_content)
-                        except:
-                            pass
+                            try:
+                                # Versuch 1: Normales JSON
+                                return json_loads(clean_content)
+                            except ValueError:
+                                pass
                             
-                        try:
-                            # Versuch 2: Suche nach { und } (falls Text davor/danach)
-                            start = clean_content.find('{')
-                            end = clean_content.rfind('}') + 1
-                            if start != -1 and end != -1:
-                                json_str = clean_content[start:end]
-                                return json.loads(json_str)
-                        except:
-                            pass
+                            try:
+                                # Versuch 2: Suche nach { und } (falls Text davor/danach)
+                                start = clean_content.find('{')
+                                end = clean_content.rfind('}') + 1
+                                if start != -1 and end != -1:
+                                    json_str = clean_content[start:end]
+                                    return json_loads(json_str)
+                            except ValueError:
+                                pass
                             
-                        try:
-                            # Versuch 3: Python Eval (Rettung für 'Single Quotes')
-                            # Lokale Modelle nutzen oft ' statt " -> Python versteht das, JSON nicht.
-                            return ast.literal_eval(clean_content)
-                        except Exception as e:
-                            print(f"\n⚠️ JSON-Rettung gescheitert: {e}")
-                            print(f"RAW: {clean_content[:100]}...")
-                            continue # Retry loop
+                            try:
+                                # Versuch 3: Python Eval (Rettung für 'Single Quotes')
+                                # Lokale Modelle nutzen oft ' statt " -> Python versteht das, JSON nicht.
+                                return ast.literal_eval(clean_content)
+                            except Exception as e:
+                                logger.warning("⚠️ JSON-Rettung gescheitert: %s", e)
+                                logger.warning("RAW: %s...", clean_content[:100])
+                                continue # Retry loop
                             
-                    return content
-                else:
-                    stop_loading.set()
-                    print(f"\n❌ API Fehler {resp.status_code}: {resp.text}")
+                        return content
+                    else:
+                        stop_loading.set()
+                        if t: t.join()
+                        logger.error("❌ API Fehler %s: %s", resp.status_code, resp.text)
                     
             except Exception as e:
                 if 'stop_loading' in locals(): stop_loading.set()
-                print(f"\n⚠️ Fehler: {e}")
+                logger.warning("⚠️ Fehler: %s", e)
                 time.sleep(1)
         
         return None
 
+    def _iter_stream_content(self, resp, deadline):
+        """Liefert die Text-Stücke einer gestreamten (SSE) Antwort, sobald sie ankommen.
+        Bricht mit TimeoutError ab, sobald deadline (Zeitpunkt wie time.time()) überschritten ist"""
+        # Bis zum Ende lesen (kein break bei [DONE]): nur ein vollständig gelesener Body
+        # gibt die Verbindung an den Pool der Session zurück
+        for line in resp.iter_lines():
+            # Keep-Alive-Kommentare und langsam tröpfelnde Tokens halten jeden einzelnen Read unter dem Timeout
+            if time.time() > deadline:
+                raise TimeoutError("KI-Antwort hat das Zeitlimit überschritten")
+            # Kommentarzeilen (z.B. ": OPENROUTER PROCESSING") und Leerzeilen überspringen
+            if not line.startswith(b"data: "):
+                continue
+            payload = line[6:]
+            if payload.strip() == b"[DONE]":
+                continue
+            choices = json_loads(payload).get("choices")
+            if choices:
+                yield choices[0].get("delta", {}).get("content") or ""
+
 
     # --- HIER FOLGEN DEINE GENERATOR-FUNKTIONEN (bleiben gleich) ---
     # Kopiere einfach generate_exercises, generate_feedback, etc. hier rein.
@@ -189,37 +260,9 @@ class AIEngine:
         """
         🚀 Generiert das 'Cool Coach' Feedback für den gesamten Test
         """
-        prompt = f"""
-    Du bist ein energetischer, cooler Lern-Coach für Schüler. 
-    Deine Mission: MOTIVATION PUR! 🚀
-    
-    Analysiere dieses Testergebnis. Sei nicht langweilig! Sei wie ein YouTuber oder Sport-Coach.
-    Sprich den Schüler direkt mit "Du" an. Nutze viele Emojis.
-
-    DATEN:
-    Fach: {subject}
-    Thema: {topic}
-    Ergebnis: {score}% ({correct} von {total} richtig)
-
-    DEINE AUFGABE:
-    Antworte STRENG als JSON:
-    {{
-        "overall_assessment": "Dein motivierendes Fazit (kurz & knackig)",
-        "key_strengths": ["Stärke 1", "Stärke 2"],
-        "main_weaknesses": ["Hier kannst du noch punkten 1", "Hier leveln wir noch hoch 2"], 
-        "learning_recommendations": [
-            {{
-                "priority": "hoch/mittel/niedrig",
-                "area": "Was genau?",
-                "action": "Konkreter Tipp", 
-                "reason": "Warum hilft das?"
-            }}
-        ],
-        "conceptual_understanding": "Einschätzung (z.B. 'Grundlagen sitzen')",
-        "next_steps": ["Schritt 1", "Schritt 2"],
-        "encouragement": "Dein finaler Motivations-Spruch"
-    }}
-    """
+        prompt = _FEEDBACK_PROMPT.format_map({
+            "subject": subject, "topic": topic, "score": score, "correct": correct, "total": total
+        })
         return self._robust_api_call(prompt, response_format="json", timeout=20)
 
     def generate_single_answer_feedback(self, question, solution, user_answer, is_correct):
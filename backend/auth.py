@@ -1,4 +1,5 @@
 import os
+import logging
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -16,6 +17,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 Tage
 # Password Hashing Konfiguration (bcrypt)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+logger = logging.getLogger(__name__)
+
 def verify_password(plain_password, hashed_password):
     """Sichere Überprüfung mit bcrypt"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,8 +27,8 @@ def get_password_hash(password):
     """
     Sicheres Hashing mit bcrypt.
     """
-    # DEBUG-AUSGABE: Zeigt uns, wie lang das Passwort ist, das gehasht wird
-    print(f"🔐 DEBUG: Hashing password... Länge: {len(password)} Zeichen")
+    # DEBUG-AUSGABE: Zeigt uns, wie lang das Passwort ist, das gehasht wird (nur bei Level DEBUG)
+    logger.debug("🔐 Hashing password... Länge: %d Zeichen", len(password))
     
     # WICHTIG: Hier darf NUR 'password' stehen, kein '+ SECRET_KEY'!
     return pwd_context.hash(password)
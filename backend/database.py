@@ -5,22 +5,97 @@ Zuständig für: SQLite-Verbindung, Tabellen-Setup, CRUD-Operationen.
 """
 
 import sqlite3
-import json
 import time
 import hashlib
+import logging
+import threading
 from datetime import datetime
+from functools import lru_cache
+from json_utils import json_dumps
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=1024)
+def _user_hash(username):
+    # Reine Funktion des Namens -> jeder User wird pro Prozess nur einmal gehasht
+    return hashlib.sha256(username.encode()).hexdigest()[:16]
+
+# === HOT-PATH SQL ===
+# Feste Statement-Strings, damit SQLite sie aus dem Statement-Cache der Verbindung holen kann
+_SQL_INSERT_TEST_SESSION = '''
+    INSERT INTO test_sessions 
+    (test_id, user_hash, subject, topic, questions, total_questions, start_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+# questions als BLOB: kommt als bytes an und geht ohne extra UTF-8-Dekodierung direkt in json_loads
+_SQL_SELECT_TEST_SESSION = '''
+    SELECT subject, topic, CAST(questions AS BLOB), user_answers, total_questions, start_time, score, correct_answers 
+    FROM test_sessions WHERE test_id = ? AND user_hash = ?
+'''
+# Wiederholung: Fragen direkt in SQLite kopieren
+_SQL_CLONE_TEST_SESSION = '''
+    INSERT INTO test_sessions 
+    (test_id, user_hash, subject, topic, questions, total_questions, start_time)
+    SELECT ?, user_hash, subject, topic, questions, total_questions, ?
+    FROM test_sessions WHERE test_id = ? AND user_hash = ?
+'''
+# Eine Zeile pro beantworteter Frage statt das komplette Antworten-JSON neu zu schreiben
+_SQL_SAVE_TEST_ANSWER = '''
+    INSERT OR REPLACE INTO test_answers (test_id, question_index, user_answer, ts)
+    VALUES (?, ?, ?, ?)
+'''
+_SQL_SELECT_TEST_ANSWERS = '''
+    SELECT question_index, user_answer, ts FROM test_answers
+    WHERE test_id = ? ORDER BY question_index
+'''
+_SQL_COMPLETE_TEST = '''
+    UPDATE test_sessions 
+    SET end_time = CURRENT_TIMESTAMP, score = ?, correct_answers = ?, 
+        time_spent_seconds = ?, status = 'completed', user_answers = ?
+    WHERE test_id = ?
+'''
+# Nach dem Abschluss steht alles im user_answers-Snapshot, die Einzelzeilen werden nicht mehr gebraucht
+_SQL_DELETE_TEST_ANSWERS = 'DELETE FROM test_answers WHERE test_id = ?'
+# KI-Feedback aus dem Hintergrund: legt die Zeile an, überschreibt aber nie eine (neuere) Antwort/Bewertung,
+# sondern setzt nur das Feedback - und nur, wenn es zur gespeicherten Antwort gehört
+_SQL_UPSERT_TEST_RESULT = '''
+    INSERT INTO test_results 
+    (test_id, user_hash, question_index, user_answer, correct_answer, is_correct, feedback)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(test_id, question_index) DO UPDATE SET feedback = excluded.feedback
+    WHERE test_results.user_answer = excluded.user_answer
+'''
+# Ergebnis-Zeilen beim Testabschluss: KI-Feedback bleibt nur erhalten, wenn es zur finalen Antwort gehört
+_SQL_UPSERT_TEST_RESULT_SCORE = '''
+    INSERT INTO test_results 
+    (test_id, user_hash, question_index, user_answer, correct_answer, is_correct)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(test_id, question_index) DO UPDATE SET
+        feedback = CASE WHEN test_results.user_answer = excluded.user_answer THEN test_results.feedback END,
+        user_answer = excluded.user_answer, correct_answer = excluded.correct_answer,
+        is_correct = excluded.is_correct
+'''
 
 class DatabaseManager:
     def __init__(self, db_path="universal_lern_buddy.db"):
         self.db_path = db_path
+        # Eine Verbindung pro Thread, die offen bleibt (statt connect/close bei jedem Aufruf)
+        self._local = threading.local()
+        # Hash des zuletzt gespeicherten Profils pro User (unveränderte Profile nicht neu schreiben)
+        self._profile_hashes = {}
         self._init_database()
 
     def get_connection(self):
-        """Erstellt eine Verbindung mit optimierten Einstellungen"""
-        conn = sqlite3.connect(self.db_path, timeout=20.0)
-        # WAL-Mode für bessere Performance bei gleichzeitigen Zugriffen
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA synchronous=NORMAL")
+        """Liefert die Verbindung des aktuellen Threads (wird beim ersten Aufruf geöffnet)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=20.0, cached_statements=256)
+            # WAL-Mode für bessere Performance bei gleichzeitigen Zugriffen
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-20000")
+            self._local.conn = conn
         return conn
 
     def _init_database(self):
@@ -87,6 +162,11 @@ class DatabaseManager:
                     session_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            # Mustererkennung: WHERE user_hash ORDER BY session_date DESC LIMIT -> Index statt Scan + Sortierung
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_study_sessions_user_date
+                ON study_sessions (user_hash, session_date DESC)
+            ''')
             
             # 5. Einzelne Übungsantworten
             cursor.execute('''
@@ -131,7 +211,7 @@ class DatabaseManager:
                     topic TEXT,
                     questions TEXT,
                     user_answers TEXT DEFAULT '[]',
-                    start_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    start_time INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
                     end_time TIMESTAMP,
                     time_spent_seconds INTEGER DEFAULT 0,
                     score REAL DEFAULT 0,
@@ -140,6 +220,11 @@ class DatabaseManager:
                     status TEXT DEFAULT 'active'
                 )
             ''')
+            # Test-Historie: WHERE user_hash + status, ORDER BY end_time -> Index-Range-Scan statt Sortierung
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_test_sessions_user_completed
+                ON test_sessions (user_hash, status, end_time DESC)
+            ''')
 
             # 8. Test-Ergebnisse (Detail)
             cursor.execute('''
@@ -156,6 +241,32 @@ class DatabaseManager:
                     answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
+            # Eine Zeile pro Frage. Alte Duplikate nur einmal entfernen (sonst scheitert der Index),
+            # danach verhindert der Index neue -> kein Tabellen-Scan bei jedem Start
+            has_index = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_test_results_question'"
+            ).fetchone()
+            if not has_index:
+                cursor.execute('''
+                    DELETE FROM test_results WHERE id NOT IN (
+                        SELECT MAX(id) FROM test_results GROUP BY test_id, question_index
+                    )
+                ''')
+                cursor.execute('''
+                    CREATE UNIQUE INDEX idx_test_results_question
+                    ON test_results (test_id, question_index)
+                ''')
+
+            # 8b. Antworten laufender Tests (append-only, eine Zeile pro Frage)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS test_answers (
+                    test_id TEXT,
+                    question_index INTEGER,
+                    user_answer TEXT,
+                    ts INTEGER,
+                    PRIMARY KEY (test_id, question_index)
+                ) WITHOUT ROWID
+            ''')
 
             # 9. Karteikarten-Sets
             cursor.execute('''
@@ -169,6 +280,11 @@ class DatabaseManager:
                     FOREIGN KEY (user_hash) REFERENCES user_profiles (user_hash)
                 )
             ''')
+            # Karteikarten-Historie und Graph: WHERE user_hash (ORDER BY created_at)
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_flashcard_sets_user_created
+                ON flashcard_sets (user_hash, created_at DESC)
+            ''')
 
             # 10. Lernpläne
             cursor.execute('''
@@ -182,50 +298,79 @@ class DatabaseManager:
                     FOREIGN KEY (user_hash) REFERENCES user_profiles (user_hash)
                 )
             ''')
-            
+            # Lernpläne: WHERE user_hash ORDER BY exam_date
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_study_plans_user_exam
+                ON study_plans (user_hash, exam_date)
+            ''')
+
+            # 11. Cache für KI-generierte Aufgaben (mehrere Sets pro Fach/Thema, älteste fliegen raus)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS exercise_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cache_key TEXT,
+                    exercises TEXT,
+                    created_at INTEGER
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_exercise_cache_key
+                ON exercise_cache (cache_key, created_at DESC)
+            ''')
+
+            # test_sessions.test_id ist Primärschlüssel und test_results hat den (test_id, question_index)-Index,
+            # die Lookups per test_id laufen also schon über Indizes. Statistiken für den Query-Planer erheben,
+            # solange noch keine vorliegen (ANALYZE auf leeren Tabellen legt nur eine leere sqlite_stat1 an).
+            # Danach hält optimize() beim Herunterfahren sie aktuell; seed_data.py frischt sie nach dem Import auf
+            has_stats = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            ).fetchone() and cursor.execute("SELECT 1 FROM sqlite_stat1 LIMIT 1").fetchone()
+            if not has_stats:
+                cursor.execute("ANALYZE")
+
             conn.commit()
             print("✅ Datenbank: Tabellen initialisiert")
             
         except Exception as e:
+            conn.rollback()
             print(f"❌ Datenbank-Init Fehler: {e}")
-        finally:
-            conn.close()
 
     # === HELPER ===
+
+    def optimize(self):
+        """PRAGMA optimize auf der Verbindung dieses Threads: analysiert die Tabellen neu, deren Statistiken
+        für die bisher gelaufenen Abfragen fehlen oder veraltet sind (auf einer frischen Verbindung wirkungslos)"""
+        self.get_connection().execute("PRAGMA optimize")
     
     def get_user_hash(self, username: str) -> str:
         """Erstellt konsistenten Hash für User-IDs (für Privacy/Verknüpfung)"""
-        return hashlib.sha256(username.encode()).hexdigest()[:16]
+        return _user_hash(username)
 
     # === USER MANAGEMENT ===
+    # Schreibzugriffe laufen in "with conn:" -> Commit bei Erfolg, Rollback bei Fehler,
+    # damit auf der wiederverwendeten Verbindung keine offene Transaktion hängen bleibt.
 
     def create_user(self, username, email, password_hash, role):
         conn = self.get_connection()
         try:
-            conn.execute('''
-                INSERT INTO users (username, email, password_hash, role)
-                VALUES (?, ?, ?, ?)
-            ''', (username, email, password_hash, role))
-            conn.commit()
+            with conn:
+                conn.execute('''
+                    INSERT INTO users (username, email, password_hash, role)
+                    VALUES (?, ?, ?, ?)
+                ''', (username, email, password_hash, role))
             return True
         except sqlite3.IntegrityError:
             return False
-        finally:
-            conn.close()
 
     def get_user_by_username(self, username):
         conn = self.get_connection()
-        try:
-            cursor = conn.execute('SELECT username, password_hash, role FROM users WHERE username = ?', (username,))
-            return cursor.fetchone()
-        finally:
-            conn.close()
+        cursor = conn.execute('SELECT username, password_hash, role FROM users WHERE username = ?', (username,))
+        return cursor.fetchone()
 
     def update_last_login(self, username):
         conn = self.get_connection()
-        conn.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE username = ?', (username,))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE username = ?', (username,))
 
     def update_user_profile_data(self, username, update_data):
         conn = self.get_connection()
@@ -236,279 +381,246 @@ class DatabaseManager:
             
             if set_clauses:
                 query = f"UPDATE users SET {', '.join(set_clauses)} WHERE username = ?"
-                conn.execute(query, params)
-                conn.commit()
+                with conn:
+                    conn.execute(query, params)
             return True
         except Exception as e:
-            print(f"DB Error: {e}")
+            logger.error("DB Error: %s", e)
             return False
-        finally:
-            conn.close()
 
     # === PROFIL & SCHULE ===
 
     def get_profile(self, user_hash):
         conn = self.get_connection()
-        try:
-            cursor = conn.execute('''
-                SELECT detected_learning_style, cognitive_patterns, performance_trends, adaptation_history
-                FROM user_profiles WHERE user_hash = ?
-            ''', (user_hash,))
-            return cursor.fetchone()
-        finally:
-            conn.close()
+        cursor = conn.execute('''
+            SELECT detected_learning_style, cognitive_patterns, performance_trends, adaptation_history
+            FROM user_profiles WHERE user_hash = ?
+        ''', (user_hash,))
+        return cursor.fetchone()
 
     def save_profile(self, user_hash, profile_data):
+        params = (
+            user_hash,
+            profile_data.get('detected_learning_style'),
+            json_dumps(profile_data.get('cognitive_patterns', {})),
+            json_dumps(profile_data.get('performance_trends', {})),
+            json_dumps(profile_data.get('adaptation_history', []))
+        )
+        profile_hash = hash(params)
+        if self._profile_hashes.get(user_hash) == profile_hash:
+            return
+        
         conn = self.get_connection()
-        try:
+        with conn:
             conn.execute('''
                 INSERT OR REPLACE INTO user_profiles 
                 (user_hash, detected_learning_style, cognitive_patterns, performance_trends, adaptation_history, updated_at)
                 VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                user_hash,
-                profile_data.get('detected_learning_style'),
-                json.dumps(profile_data.get('cognitive_patterns', {})),
-                json.dumps(profile_data.get('performance_trends', {})),
-                json.dumps(profile_data.get('adaptation_history', []))
-            ))
-            conn.commit()
-        finally:
-            conn.close()
+            ''', params)
+        self._profile_hashes[user_hash] = profile_hash
 
     def save_school_context(self, user_hash, data):
         conn = self.get_connection()
-        try:
-            # Check existiert?
-            exists = conn.execute('SELECT 1 FROM school_contexts WHERE user_hash = ?', (user_hash,)).fetchone()
-            
-            if exists:
-                conn.execute('''
-                    UPDATE school_contexts 
-                    SET grade=?, school_type=?, state=?, subjects=?, curriculum_focus=?, updated_at=CURRENT_TIMESTAMP
-                    WHERE user_hash=?
-                ''', (data['grade'], data['school_type'], data['state'], data['subjects'], data['curriculum_focus'], user_hash))
-            else:
-                conn.execute('''
-                    INSERT INTO school_contexts (user_hash, grade, school_type, state, subjects, curriculum_focus)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user_hash, data['grade'], data['school_type'], data['state'], data['subjects'], data['curriculum_focus']))
-            conn.commit()
-            return True
-        finally:
-            conn.close()
+        with conn:
+            # Upsert in einem Statement statt SELECT + UPDATE/INSERT (user_hash ist Primärschlüssel)
+            conn.execute('''
+                INSERT INTO school_contexts (user_hash, grade, school_type, state, subjects, curriculum_focus)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_hash) DO UPDATE SET
+                    grade=excluded.grade, school_type=excluded.school_type, state=excluded.state,
+                    subjects=excluded.subjects, curriculum_focus=excluded.curriculum_focus,
+                    updated_at=CURRENT_TIMESTAMP
+            ''', (user_hash, data['grade'], data['school_type'], data['state'], data['subjects'], data['curriculum_focus']))
+        return True
 
     def get_school_context(self, user_hash):
         conn = self.get_connection()
-        try:
-            return conn.execute('''
-                SELECT grade, school_type, state, subjects, curriculum_focus 
-                FROM school_contexts WHERE user_hash = ?
-            ''', (user_hash,)).fetchone()
-        finally:
-            conn.close()
+        return conn.execute('''
+            SELECT grade, school_type, state, subjects, curriculum_focus 
+            FROM school_contexts WHERE user_hash = ?
+        ''', (user_hash,)).fetchone()
 
     # === TRACKING & ANALYTICS ===
 
     def log_session(self, user_hash, subject, duration, topics, score, engagement, difficulty):
         conn = self.get_connection()
-        conn.execute('''
-            INSERT INTO study_sessions 
-            (user_hash, subject, duration_minutes, topics, performance_score, engagement_level, difficulty_level)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_hash, subject, duration, json.dumps(topics), score, engagement, difficulty))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute('''
+                INSERT INTO study_sessions 
+                (user_hash, subject, duration_minutes, topics, performance_score, engagement_level, difficulty_level)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (user_hash, subject, duration, json_dumps(topics), score, engagement, difficulty))
 
     def get_sessions(self, user_hash, limit=50):
+        """Nur die Spalten, die die Mustererkennung auswertet: Fach, Dauer, Leistung"""
         conn = self.get_connection()
-        try:
-            return conn.execute('''
-                SELECT subject, duration_minutes, topics, performance_score, engagement_level, session_date
-                FROM study_sessions WHERE user_hash = ? ORDER BY session_date DESC LIMIT ?
-            ''', (user_hash, limit)).fetchall()
-        finally:
-            conn.close()
+        return conn.execute('''
+            SELECT subject, duration_minutes, performance_score
+            FROM study_sessions WHERE user_hash = ? ORDER BY session_date DESC LIMIT ?
+        ''', (user_hash, limit)).fetchall()
 
     def get_analytics_raw_data(self, user_hash):
         """Holt aggregierte Daten für Analytics"""
         conn = self.get_connection()
-        try:
-            # 1. Antworten Stats
-            subject_stats = conn.execute('''
-                SELECT COUNT(*), SUM(CASE WHEN is_correct THEN 1 ELSE 0 END), AVG(time_spent_seconds), subject, topic
-                FROM exercise_answers WHERE user_hash = ? GROUP BY subject, topic
-            ''', (user_hash,)).fetchall()
-            
-            # 2. Fehler
-            mistakes = conn.execute('''
-                SELECT error_type, frequency, topic, subject FROM mistake_patterns 
-                WHERE user_hash = ? ORDER BY frequency DESC LIMIT 10
-            ''', (user_hash,)).fetchall()
-            
-            # 3. Sessions
-            sessions = conn.execute('''
-                SELECT COUNT(*), AVG(duration_minutes), AVG(performance_score), subject
-                FROM study_sessions WHERE user_hash = ? GROUP BY subject
-            ''', (user_hash,)).fetchall()
-            
-            return subject_stats, mistakes, sessions
-        finally:
-            conn.close()
+        # 1. Antworten Stats
+        subject_stats = conn.execute('''
+            SELECT COUNT(*), SUM(CASE WHEN is_correct THEN 1 ELSE 0 END), AVG(time_spent_seconds), subject, topic
+            FROM exercise_answers WHERE user_hash = ? GROUP BY subject, topic
+        ''', (user_hash,)).fetchall()
+        
+        # 2. Fehler
+        mistakes = conn.execute('''
+            SELECT error_type, frequency, topic, subject FROM mistake_patterns 
+            WHERE user_hash = ? ORDER BY frequency DESC LIMIT 10
+        ''', (user_hash,)).fetchall()
+        
+        # 3. Sessions
+        sessions = conn.execute('''
+            SELECT COUNT(*), AVG(duration_minutes), AVG(performance_score), subject
+            FROM study_sessions WHERE user_hash = ? GROUP BY subject
+        ''', (user_hash,)).fetchall()
+        
+        return subject_stats, mistakes, sessions
 
-    def get_subject_averages(self, user_hash):
-        """Holt Durchschnittsscore pro Fach für den Graphen"""
+    def get_subject_graph_rows(self, user_hash):
+        """Holt pro Fach Durchschnittsscore, Anzahl Tests und Anzahl Lern-Sets für den Graphen (eine Abfrage)"""
         conn = self.get_connection()
-        try:
-            # Wir nehmen Daten aus Test-Sessions UND Study-Sessions
-            # Hier vereinfacht: Nur Test-Sessions für präzise Leistungsdaten
-            results = conn.execute('''
-                SELECT subject, AVG(score) as avg_score, COUNT(*) as count 
+        # Nur abgeschlossene Test-Sessions für präzise Leistungsdaten, dazu die Lern-Sets.
+        # UNION ALL + GROUP BY ersetzt den FULL OUTER JOIN (Fächer nur mit Tests oder nur mit Karten)
+        return conn.execute('''
+            SELECT subject, COALESCE(MAX(avg_score), 0), SUM(test_count), SUM(card_count) FROM (
+                SELECT subject, AVG(score) AS avg_score, COUNT(*) AS test_count, 0 AS card_count
                 FROM test_sessions 
                 WHERE user_hash = ? AND status = 'completed' 
                 GROUP BY subject
-            ''', (user_hash,)).fetchall()
-            return results
-        finally:
-            conn.close()
+                UNION ALL
+                SELECT subject, NULL, 0, COUNT(*)
+                FROM flashcard_sets 
+                WHERE user_hash = ? 
+                GROUP BY subject
+            )
+            GROUP BY subject
+        ''', (user_hash, user_hash)).fetchall()
 
     # === TESTS ===
 
     def create_test_session(self, test_id, user_hash, subject, topic, questions_json, count, start_time):
         conn = self.get_connection()
-        conn.execute('''
-            INSERT INTO test_sessions 
-            (test_id, user_hash, subject, topic, questions, total_questions, start_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (test_id, user_hash, subject, topic, questions_json, count, start_time))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(_SQL_INSERT_TEST_SESSION, (test_id, user_hash, subject, topic, questions_json, count, start_time))
+
+    def clone_test_session(self, new_test_id, old_test_id, user_hash, start_time):
+        """Legt einen neuen Durchlauf mit denselben Fragen an, das Fragen-JSON bleibt dabei in SQLite"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute(_SQL_CLONE_TEST_SESSION, (new_test_id, start_time, old_test_id, user_hash))
 
     def get_test_session(self, test_id, user_hash):
         conn = self.get_connection()
-        try:
-            return conn.execute('''
-                SELECT subject, topic, questions, user_answers, total_questions, start_time, score, correct_answers 
-                FROM test_sessions WHERE test_id = ? AND user_hash = ?
-            ''', (test_id, user_hash)).fetchone()
-        finally:
-            conn.close()
-
-    def update_test_answer(self, test_id, answers_json):
+        return conn.execute(_SQL_SELECT_TEST_SESSION, (test_id, user_hash)).fetchone()
+
+    def save_test_answer(self, test_id, question_index, answer_json, ts):
+        conn = self.get_connection()
+        with conn:
+            conn.execute(_SQL_SAVE_TEST_ANSWER, (test_id, question_index, answer_json, ts))
+
+    def get_test_answers(self, test_id):
         conn = self.get_connection()
-        conn.execute('UPDATE test_sessions SET user_answers = ? WHERE test_id = ?', (answers_json, test_id))
-        conn.commit()
-        conn.close()
+        return conn.execute(_SQL_SELECT_TEST_ANSWERS, (test_id,)).fetchall()
 
-    def complete_test(self, test_id, score, correct, time_spent, answers_json):
+    def complete_test(self, test_id, score, correct, time_spent, answers_json, results=()):
+        """Schließt den Test ab und speichert die Einzelergebnisse in derselben Transaktion"""
         conn = self.get_connection()
-        conn.execute('''
-            UPDATE test_sessions 
-            SET end_time = CURRENT_TIMESTAMP, score = ?, correct_answers = ?, 
-                time_spent_seconds = ?, status = 'completed', user_answers = ?
-            WHERE test_id = ?
-        ''', (score, correct, time_spent, answers_json, test_id))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(_SQL_COMPLETE_TEST, (score, correct, time_spent, answers_json, test_id))
+            conn.executemany(_SQL_UPSERT_TEST_RESULT_SCORE, results)
+            conn.execute(_SQL_DELETE_TEST_ANSWERS, (test_id,))
 
     def save_test_result_detail(self, test_id, user_hash, idx, u_ans, c_ans, is_corr, feedback):
         conn = self.get_connection()
-        conn.execute('''
-            INSERT INTO test_results 
-            (test_id, user_hash, question_index, user_answer, correct_answer, is_correct, feedback)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (test_id, user_hash, idx, u_ans, c_ans, 1 if is_corr else 0, feedback))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute(_SQL_UPSERT_TEST_RESULT, (test_id, user_hash, idx, u_ans, c_ans, 1 if is_corr else 0, feedback))
 
     def get_test_history(self, user_hash, limit=10):
         conn = self.get_connection()
-        try:
-            return conn.execute('''
-                SELECT test_id, subject, topic, score, correct_answers, total_questions, 
-                    time_spent_seconds, start_time, end_time
-                FROM test_sessions WHERE user_hash = ? AND status = 'completed'
-                ORDER BY end_time DESC LIMIT ?
-            ''', (user_hash, limit)).fetchall()
-        finally:
-            conn.close()
+        return conn.execute('''
+            SELECT test_id, subject, topic, score, correct_answers, total_questions, 
+                time_spent_seconds, start_time, end_time
+            FROM test_sessions WHERE user_hash = ? AND status = 'completed'
+            ORDER BY end_time DESC LIMIT ?
+        ''', (user_hash, limit)).fetchall()
 
     # === FLASHCARDS ===
 
     def save_flashcard_set(self, user_hash, subject, topic, cards):
         conn = self.get_connection()
-        try:
+        with conn:
             cursor = conn.execute('''
                 INSERT INTO flashcard_sets (user_hash, subject, topic, cards)
                 VALUES (?, ?, ?, ?)
-            ''', (user_hash, subject, topic, json.dumps(cards)))
-            conn.commit()
-            return cursor.lastrowid
-        finally:
-            conn.close()
+            ''', (user_hash, subject, topic, json_dumps(cards)))
+        return cursor.lastrowid
 
     def get_flashcard_history(self, user_hash, limit=10):
         conn = self.get_connection()
-        try:
-            return conn.execute('''
-                SELECT id, subject, topic, cards, created_at
-                FROM flashcard_sets 
-                WHERE user_hash = ? 
-                ORDER BY created_at DESC 
-                LIMIT ?
-            ''', (user_hash, limit)).fetchall()
-        finally:
-            conn.close()
+        # Kartenanzahl zählt SQLite direkt (JSON1), das komplette Karten-JSON muss nicht nach Python
+        return conn.execute('''
+            SELECT id, subject, topic, json_array_length(cards), created_at
+            FROM flashcard_sets 
+            WHERE user_hash = ? 
+            ORDER BY created_at DESC 
+            LIMIT ?
+        ''', (user_hash, limit)).fetchall()
 
     def get_flashcard_set(self, set_id, user_hash):
         conn = self.get_connection()
-        try:
-            return conn.execute('''
-                SELECT subject, topic, cards 
-                FROM flashcard_sets 
-                WHERE id = ? AND user_hash = ?
-            ''', (set_id, user_hash)).fetchone()
-        finally:
-            conn.close()
+        return conn.execute('''
+            SELECT subject, topic, cards 
+            FROM flashcard_sets 
+            WHERE id = ? AND user_hash = ?
+        ''', (set_id, user_hash)).fetchone()
 
-    def get_flashcard_counts(self, user_hash):
-        """Zählt Lern-Sets pro Fach für den Graphen"""
+    # === AUFGABEN-CACHE ===
+
+    def get_cached_exercise_sets(self, cache_key, since, limit):
+        """Die neuesten gecachten Aufgaben-Sets für einen Schlüssel (nicht älter als since, Epoch-Sekunden)"""
         conn = self.get_connection()
-        try:
-            results = conn.execute('''
-                SELECT subject, COUNT(*) as count 
-                FROM flashcard_sets 
-                WHERE user_hash = ? 
-                GROUP BY subject
-            ''', (user_hash,)).fetchall()
-            return results
-        finally:
-            conn.close()
+        return [row[0] for row in conn.execute('''
+            SELECT exercises FROM exercise_cache
+            WHERE cache_key = ? AND created_at >= ?
+            ORDER BY created_at DESC, id DESC LIMIT ?
+        ''', (cache_key, since, limit))]
+
+    def save_cached_exercise_set(self, cache_key, exercises_json, created_at, keep):
+        """Speichert ein neues Set und behält pro Schlüssel nur die keep neuesten"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                'INSERT INTO exercise_cache (cache_key, exercises, created_at) VALUES (?, ?, ?)',
+                (cache_key, exercises_json, created_at)
+            )
+            conn.execute('''
+                DELETE FROM exercise_cache WHERE cache_key = ? AND id NOT IN (
+                    SELECT id FROM exercise_cache WHERE cache_key = ?
+                    ORDER BY created_at DESC, id DESC LIMIT ?
+                )
+            ''', (cache_key, cache_key, keep))
 
     # === LERNPLÄNE ===
 
     def save_study_plan(self, user_hash, subject, exam_date, plan_data):
         conn = self.get_connection()
-        try:
+        with conn:
             conn.execute('INSERT INTO study_plans (user_hash, subject, exam_date, plan_data) VALUES (?, ?, ?, ?)',
-                        (user_hash, subject, exam_date, json.dumps(plan_data)))
-            conn.commit()
-            return True
-        finally:
-            conn.close()
+                        (user_hash, subject, exam_date, json_dumps(plan_data)))
+        return True
 
     def get_study_plans(self, user_hash):
         conn = self.get_connection()
-        try:
-            return conn.execute('SELECT id, subject, exam_date, plan_data, created_at FROM study_plans WHERE user_hash = ? ORDER BY exam_date ASC', (user_hash,)).fetchall()
-        finally:
-            conn.close()
+        return conn.execute('SELECT id, subject, exam_date, plan_data, created_at FROM study_plans WHERE user_hash = ? ORDER BY exam_date ASC', (user_hash,)).fetchall()
             
     def delete_study_plan(self, plan_id, user_hash):
         conn = self.get_connection()
-        try:
+        with conn:
             conn.execute('DELETE FROM study_plans WHERE id = ? AND user_hash = ?', (plan_id, user_hash))
-            conn.commit()
-            return True
-        finally:
-            conn.close()
\ No newline at end of file
+        return True
\ No newline at end of file
@@ -0,0 +1,20 @@
+"""
+⚡ JSON-HELFER
+Nutzt orjson (in C geschrieben, deutlich schneller), falls installiert.
+Ohne orjson wird das normale json-Modul verwendet.
+"""
+
+import json
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj):
+        # orjson liefert bytes, in der DB speichern wir TEXT
+        return orjson.dumps(obj).decode()
+
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
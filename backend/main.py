@@ -14,11 +14,15 @@ from auth import create_access_token, verify_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from datetime import datetime, timedelta
 import sys
 import os
-import json
+import logging
+from json_utils import json_loads
 import sqlite3
 
 # 🔧 Konfiguration
 sys.path.append(os.path.dirname(__file__))
+# Status-Meldungen der Module (früher print) laufen über logging -> INFO sichtbar machen
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
 
 try:
     from universal_lern_buddy import UniversalLernBuddy
@@ -100,6 +104,12 @@ class UserProfileUpdate(BaseModel):
 class RetakeRequest(BaseModel):
     test_id: str
 
+@app.on_event("shutdown")
+def optimize_database():
+    """📊 Planer-Statistiken vor dem Beenden auffrischen (Server-Thread hat die meisten Abfragen gestellt)"""
+    if buddy:
+        buddy.db.optimize()
+
 # === AUTHENTIFIZIERUNG ===
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
@@ -266,8 +276,9 @@ async def update_user_profile(
 
 # === GESCHÜTZTE API ENDPOINTS ===
 
+# Ohne async (Threadpool), siehe /api/start-test
 @app.post("/api/generate-exercises")
-async def generate_exercises(
+def generate_exercises(
     request: ExerciseRequest, 
     current_user: dict = Depends(get_current_user)
 ):
@@ -310,8 +321,9 @@ async def get_profile(current_user: dict = Depends(get_current_user)):
 
 # === TEST-MODUS API ENDPOINTS ===
 
+# Ohne async: FastAPI führt den Endpoint im Threadpool aus, die KI-Generierung blockiert den Event-Loop nicht
 @app.post("/api/start-test")
-async def start_test_session(
+def start_test_session(
     test_request: TestRequest,
     current_user: dict = Depends(get_current_user)
 ):
@@ -329,7 +341,7 @@ async def start_test_session(
         return {
             "success": True,
             "data": test_session,
-            "message": f"Test gestartet mit {test_request.question_count} Fragen"
+            "message": f"Test gestartet mit {test_session['total_questions']} Fragen"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Test-Fehler: {str(e)}")
@@ -380,6 +392,35 @@ async def submit_answer_multiple(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Antwort-Fehler: {str(e)}")
 
+@app.get("/api/answer-feedback/{test_id}/{question_index}")
+async def get_answer_feedback(
+    test_id: str,
+    question_index: int,
+    current_user: dict = Depends(get_current_user)
+):
+    """💬 Holt das KI-Feedback zu einer Antwort (wird im Hintergrund erzeugt)"""
+    if not buddy:
+        raise HTTPException(status_code=500, detail="Lern-Buddy nicht geladen")
+    
+    result = buddy.get_answer_feedback(current_user['sub'], test_id, question_index)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Kein Feedback für diese Antwort")
+    return {"success": True, "data": result}
+
+@app.get("/api/test-feedback/{test_id}")
+async def get_test_feedback(
+    test_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """🚀 Holt die KI-Gesamtauswertung eines Tests (wird im Hintergrund erzeugt)"""
+    if not buddy:
+        raise HTTPException(status_code=500, detail="Lern-Buddy nicht geladen")
+    
+    result = buddy.get_test_feedback(current_user['sub'], test_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Kein Feedback für diesen Test")
+    return {"success": True, "data": result}
+
 @app.post("/api/finish-test")
 async def finish_test(
     finish_data: dict,
@@ -474,54 +515,65 @@ async def save_answer(
 async def debug_test(test_id: str):
     """🔍 Debug-Endpoint für Test-Daten (ohne Authentifizierung)"""
     try:
-        print(f"🔍 DEBUG TEST AUFGERUFEN FÜR: {test_id}")
+        logger.debug("🔍 DEBUG TEST AUFGERUFEN FÜR: %s", test_id)
+        
+        if not buddy:
+            return {"success": False, "error": "Lern-Buddy nicht geladen"}
         
-        # Direkter Datenbank-Zugriff für Debugging
-        conn = sqlite3.connect("universal_lern_buddy.db", timeout=20.0)
-        cursor = conn.cursor()
+        # Direkter Datenbank-Zugriff für Debugging über die Verbindung des DatabaseManagers (pro Thread offen).
+        # Das Fragen-JSON bleibt in SQLite: Länge, Typ, Anzahl und die erste Aufgabe rechnet die DB aus
+        cursor = buddy.db.get_connection().cursor()
+        cursor.row_factory = sqlite3.Row
         
         cursor.execute('''
-            SELECT test_id, subject, topic, questions, user_answers, total_questions, 
-                   start_time, status, score, correct_answers
+            SELECT test_id, subject, topic, length(questions) AS questions_length, user_answers,
+                   total_questions, status, score, correct_answers,
+                   json_valid(questions) AS questions_valid,
+                   CASE WHEN json_valid(questions) THEN json_type(questions) END AS questions_type,
+                   CASE WHEN json_valid(questions) THEN json_array_length(questions, '$.exercises') END AS exercises_count,
+                   CASE WHEN json_valid(questions) THEN json_extract(questions, '$.exercises[0]') END AS sample
             FROM test_sessions WHERE test_id = ?
         ''', (test_id,))
         
         test_data = cursor.fetchone()
-        conn.close()
+        cursor.close()
         
         if test_data:
             debug_info = {
-                "test_id": test_data[0],
-                "subject": test_data[1],
-                "topic": test_data[2],
-                "questions_length": len(test_data[3]) if test_data[3] else 0,
-                "user_answers": test_data[4],
-                "total_questions": test_data[5],
-                "status": test_data[7],
-                "score": test_data[8],
-                "correct_answers": test_data[9]
+                "test_id": test_data["test_id"],
+                "subject": test_data["subject"],
+                "topic": test_data["topic"],
+                "questions_length": test_data["questions_length"] or 0,
+                "user_answers": test_data["user_answers"],
+                "total_questions": test_data["total_questions"],
+                "status": test_data["status"],
+                "score": test_data["score"],
+                "correct_answers": test_data["correct_answers"]
             }
             
-            # Versuche Fragen zu parsen
-            if test_data[3]:
-                try:
-                    questions = json.loads(test_data[3])
-                    debug_info["questions_type"] = type(questions).__name__
-                    if isinstance(questions, dict) and 'exercises' in questions:
-                        debug_info["exercises_count"] = len(questions['exercises'])
-                        if questions['exercises']:
-                            debug_info["sample_question"] = questions['exercises'][0].get('question', '')[:100] + "..."
-                            debug_info["sample_options"] = list(questions['exercises'][0].get('options', {}).keys())[:3]
-                            debug_info["sample_correct"] = questions['exercises'][0].get('correct_answers', [])
+            # Fragen-Struktur auswerten
+            if test_data["questions_length"]:
+                if not test_data["questions_valid"]:
+                    debug_info["questions_error"] = "Ungültiges JSON"
+                else:
+                    debug_info["questions_type"] = {"object": "dict", "array": "list"}.get(test_data["questions_type"], test_data["questions_type"])
+                    if test_data["exercises_count"] is not None:
+                        debug_info["exercises_count"] = test_data["exercises_count"]
+                        if test_data["sample"]:
+                            try:
+                                sample = json_loads(test_data["sample"])
+                                debug_info["sample_question"] = sample.get('question', '')[:100] + "..."
+                                debug_info["sample_options"] = list(sample.get('options', {}).keys())[:3]
+                                debug_info["sample_correct"] = sample.get('correct_answers', [])
+                            except Exception as e:
+                                debug_info["questions_error"] = str(e)
                     else:
                         debug_info["questions_structure"] = "Unbekannte Struktur"
-                except Exception as e:
-                    debug_info["questions_error"] = str(e)
             
             # Versuche Antworten zu parsen
-            if test_data[4] and test_data[4] != '[]':
+            if test_data["user_answers"] and test_data["user_answers"] != '[]':
                 try:
-                    user_answers = json.loads(test_data[4])
+                    user_answers = json_loads(test_data["user_answers"])
                     debug_info["user_answers_parsed"] = user_answers
                     debug_info["user_answers_count"] = len(user_answers)
                 except Exception as e:
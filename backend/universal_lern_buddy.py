@@ -3,34 +3,123 @@
 Verbindet Datenbank, KI-Engine und Business-Logik.
 """
 
-import json
 import time
+import logging
+import itertools
+import random
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from database import DatabaseManager
+from json_utils import json_loads, json_dumps
 from ai_engine import AIEngine  # Unsere neue KI-Klasse
+from auth import get_password_hash, verify_password
+
+# Status-Meldungen pro Request über logging statt print: kein stdout-Lock/Encoding,
+# wenn das Level nicht aktiv ist (Format-Argumente werden erst bei Ausgabe eingesetzt)
+logger = logging.getLogger(__name__)
+
+# Score-Schwellen als Tabellen (bisect statt if-Kaskade)
+_LEVEL_THRESHOLDS = (60, 90)
+_LEVELS = ("Braucht Übung", "Gut", "Exzellent")
+_COLOR_THRESHOLDS = (50, 80)
+_COLORS = ("#dc3545", "#ffc107", "#28a745")  # Rot, Gelb, Grün
+
+# Logische Verbindungen zwischen Fächern für den Wissens-Graphen (ändern sich nie)
+_SUBJECT_CONNECTIONS = (
+    ("Mathe", "Physik"), ("Mathe", "Informatik"), ("Mathe", "Chemie"),
+    ("Physik", "Chemie"), ("Biologie", "Chemie"),
+    ("Deutsch", "Englisch"), ("Englisch", "Französisch"), ("Englisch", "Latein"),
+    ("Geschichte", "Politik"), ("Geschichte", "Deutsch"),
+    ("Wirtschaft", "Mathe"), ("Wirtschaft", "Politik"),
+    ("Geografie", "Wirtschaft"), ("Biologie", "Geografie")
+)
+
+# Einheitliche Kantenfarbe im Graphen (wird nur serialisiert, daher ein gemeinsames dict für alle Kanten)
+_EDGE_COLOR = {"color": "#999", "opacity": 0.4}
+
+# Platzhalter-Aufgabe, falls die KI nicht erreichbar ist (nur die Frage hängt vom Thema ab)
+_FALLBACK_QUESTION = "Beispielfrage zu {topic} (KI nicht erreichbar)"
+_FALLBACK_EXERCISE = {
+    "options": {"A": "Option 1", "B": "Option 2"},
+    "correct_answers": ["A"],
+    "explanation": "Dies ist ein Platzhalter.",
+    "difficulty": "mittel",
+    "multiple_correct": False
+}
+_FALLBACK_TIPS = ("Verbindung zur KI prüfen",)
+
+# Gesamtfeedback ohne KI: alles außer der Punktzahl ist konstant (Tupel -> kann nicht verändert werden)
+_FALLBACK_FEEDBACK = {
+    "key_strengths": ("Durchgehalten",),
+    "main_weaknesses": (),
+    "learning_recommendations": (),
+    "conceptual_understanding": "Nicht bewertbar",
+    "next_steps": ("Weiterüben",),
+    "encouragement": "Dranbleiben! 💪"
+}
+
+# Fortlaufende Test-IDs: Start bei der aktuellen Zeit in µs, damit auch nach einem Neustart
+# nichts kollidiert; next() ist unter dem GIL atomar -> kein Lock, keine Doppel-IDs in derselben Sekunde
+_TEST_IDS = itertools.count(time.time_ns() // 1000)
+
+# Aufgaben-Cache pro Fach/Thema: erst wenn genug frische KI-Sets da sind, werden Tests daraus gemischt.
+# Läuft ein Set ab, holt der nächste Start wieder eins von der KI -> der Pool erneuert sich laufend
+_EXERCISE_CACHE_SETS = 5
+# Obergrenze pro Test und Größe einer KI-Teilanfrage (größere Tests laufen parallel in Teilen)
+_MAX_EXERCISE_COUNT = 50
+_EXERCISE_CHUNK = 10
+_EXERCISE_CACHE_TTL = 7 * 24 * 3600  # Sekunden
+
+# Obergrenze für den Test-Cache: abgebrochene Tests werden nie per Finish entfernt
+_TEST_CACHE_MAX = 256
+
+# Hintergrund-Jobs (KI-Feedback) werden nach dieser Zeit verworfen, auch wenn nie abgeholt
+_JOB_TTL = 3600  # Sekunden
+
+def _prune_jobs(jobs):
+    """Entfernt abgelaufene Jobs; das dict ist nach Einfügezeit sortiert (letztes Tupel-Feld)"""
+    cutoff = time.monotonic() - _JOB_TTL
+    while jobs:
+        key = next(iter(jobs))
+        if jobs[key][-1] >= cutoff: break
+        del jobs[key]
+
+# Lernprofil so lange wiederverwenden, statt bei jedem Aufruf alle Sessions neu auszuwerten
+_PROFILE_TTL = 600  # Sekunden
 
 class UniversalLernBuddy:
     def __init__(self, db_path="universal_lern_buddy.db"):
         # Initialisiere die Module
         self.db = DatabaseManager(db_path)
         self.ai = AIEngine()
+        # Laufende Tests im Speicher: test_id -> Fragen + vorberechnete Lösungs-Sets
+        self._test_cache = {}
+        # KI-Einzelfeedback läuft im Hintergrund: (test_id, question_index) -> (user_hash, Future, Antworten, Zeitpunkt)
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        self._feedback_jobs = {}
+        # KI-Gesamtauswertung nach Testende: test_id -> (user_hash, Future, (score, correct, total), Zeitpunkt)
+        self._test_feedback_jobs = {}
+        # Eigener Pool für große Tests in KI-Teilanfragen, damit ein Teststart nicht hinter Feedback-Jobs wartet
+        self._generation_executor = ThreadPoolExecutor(max_workers=_MAX_EXERCISE_COUNT // _EXERCISE_CHUNK)
+        # Zuletzt erkanntes Lernprofil: user_hash -> (Zeitpunkt, Profil)
+        self._profile_cache = {}
         print("✅ KI-Lern-Buddy Controller bereit")
 
     # === USER & AUTH ===
 
     def create_user(self, username, email, password, role="student"):
-        from auth import get_password_hash
         pwd_hash = get_password_hash(password)
         
         success = self.db.create_user(username, email, pwd_hash, role)
         if success:
             user_hash = self.db.get_user_hash(username)
             self.db.save_profile(user_hash, {"detected_learning_style": "adaptiv_ausgeglichen"})
-            print(f"✅ User {username} angelegt")
+            logger.info("✅ User %s angelegt", username)
         return success
 
     def authenticate_user(self, username, password):
-        from auth import verify_password
         user_data = self.db.get_user_by_username(username)
         
         if user_data and verify_password(password, user_data[1]):
@@ -49,7 +138,7 @@ class UniversalLernBuddy:
             'grade': school_data.get('grade'),
             'school_type': school_data.get('school_type'),
             'state': school_data.get('state', 'Bayern'),
-            'subjects': json.dumps(school_data.get('subjects', [])),
+            'subjects': json_dumps(school_data.get('subjects', [])),
             'curriculum_focus': school_data.get('curriculum_focus', 'allgemein')
         }
         return self.db.save_school_context(user_hash, db_data)
@@ -60,7 +149,7 @@ class UniversalLernBuddy:
         if res:
             return {
                 "grade": res[0], "school_type": res[1], "state": res[2],
-                "subjects": json.loads(res[3]) if res[3] else [], "curriculum_focus": res[4]
+                "subjects": json_loads(res[3]) if res[3] else [], "curriculum_focus": res[4]
             }
         return {}
 
@@ -68,13 +157,15 @@ class UniversalLernBuddy:
 
     def detect_learning_patterns(self, username):
         user_hash = self.db.get_user_hash(username)
+        cached = self._profile_cache.get(user_hash)
+        if cached and time.monotonic() - cached[0] < _PROFILE_TTL:
+            return cached[1]
         sessions = self.db.get_sessions(user_hash)
         
         # Logik: Muster erkennen
         patterns = self._analyze_learning_patterns(sessions)
         style = self._detect_learning_style(patterns)
         
-        profile = self.db.get_profile(user_hash)
         current_profile = {
             "detected_learning_style": style,
             "cognitive_patterns": patterns,
@@ -82,17 +173,17 @@ class UniversalLernBuddy:
             "adaptation_history": []
         }
         self.db.save_profile(user_hash, current_profile)
+        self._profile_cache[user_hash] = (time.monotonic(), current_profile)
         return current_profile
 
     def _analyze_learning_patterns(self, sessions):
-        patterns = {"duration_patterns": [], "performance_by_subject": {}}
-        for s in sessions:
-            patterns["duration_patterns"].append(s[1])
-            subj = s[0]
-            if subj not in patterns["performance_by_subject"]:
-                patterns["performance_by_subject"][subj] = []
-            patterns["performance_by_subject"][subj].append(s[3])
-        return patterns
+        by_subject = defaultdict(list)
+        for subj, _, perf in sessions:
+            by_subject[subj].append(perf)
+        return {
+            "duration_patterns": [s[1] for s in sessions],
+            "performance_by_subject": dict(by_subject)
+        }
 
     def _detect_learning_style(self, patterns):
         durations = patterns.get("duration_patterns", [])
@@ -105,26 +196,55 @@ class UniversalLernBuddy:
     # === ÜBUNGEN & TEST MODUS ===
 
     def generate_personalized_exercises(self, username, subject, topic, count=3):
-        # Versuche KI-Generierung
-        exercises = self.ai.generate_exercises(subject, topic, count)
-        
-        if exercises:
-            return exercises
+        count = max(1, min(count, _MAX_EXERCISE_COUNT))
+        # Der KI-Prompt hängt nur von Fach und Thema ab -> das ist auch der Cache-Schlüssel
+        cache_key = f"{subject.strip().lower()}|{topic.strip().lower()}"
+        cached_sets = self.db.get_cached_exercise_sets(
+            cache_key, int(time.time()) - _EXERCISE_CACHE_TTL, _EXERCISE_CACHE_SETS
+        )
+        if len(cached_sets) >= _EXERCISE_CACHE_SETS:
+            sets = [json_loads(s) for s in cached_sets]
+            # Gleiche Fragen aus verschiedenen Sets nur einmal in den Pool
+            pool = list({ex.get('question'): ex for st in sets for ex in st['exercises']}.values())
+            if len(pool) >= count:
+                return {"exercises": random.sample(pool, count), "adaptive_tips": sets[0].get('adaptive_tips', [])}
+        
+        # Versuche KI-Generierung, große Tests in parallelen Teil-Anfragen
+        if count > _EXERCISE_CHUNK:
+            sizes = [_EXERCISE_CHUNK] * (count // _EXERCISE_CHUNK)
+            if count % _EXERCISE_CHUNK:
+                sizes.append(count % _EXERCISE_CHUNK)
+            parts = list(self._generation_executor.map(lambda n: self.ai.generate_exercises(subject, topic, n), sizes))
+        else:
+            parts = [self.ai.generate_exercises(subject, topic, count)]
+        
+        parts = [p for p in map(self._clean_exercises, parts) if p]
+        for p in parts:
+            self.db.save_cached_exercise_set(cache_key, json_dumps(p), int(time.time()), _EXERCISE_CACHE_SETS)
+        if len(parts) == 1:
+            return parts[0]
+        if parts:
+            # Teil-Ergebnisse zusammenführen, doppelte Fragen nur einmal
+            merged = list({ex.get('question'): ex for p in parts for ex in p['exercises']}.values())
+            return {"exercises": merged[:count], "adaptive_tips": parts[0].get('adaptive_tips', [])}
             
         # Fallback wenn KI scheitert
         return self._get_mc_multiple_fallback_exercises(subject, topic, count)
 
     def start_test_session(self, username, subject, topic, count=10):
         user_hash = self.db.get_user_hash(username)
-        test_id = f"test_{int(time.time())}_{user_hash}"
+        test_id = f"test_{next(_TEST_IDS):x}_{user_hash}"
         
-        print(f"⏳ Generiere Aufgaben für {subject}...")
+        logger.info("⏳ Generiere Aufgaben für %s...", subject)
         exercises_result = self.generate_personalized_exercises(username, subject, topic, count)
+        # Tatsächliche Anzahl (begrenzt bzw. weniger, wenn die KI nicht alle Fragen geliefert hat)
+        count = len(exercises_result['exercises'])
         
-        # Zeit startet erst nach Generierung!
-        start_time = datetime.utcnow().isoformat()
+        # Zeit startet erst nach Generierung! (Epoch-Sekunden, kein ISO-String)
+        start_time = int(time.time())
         
-        self.db.create_test_session(test_id, user_hash, subject, topic, json.dumps(exercises_result), count, start_time)
+        self.db.create_test_session(test_id, user_hash, subject, topic, json_dumps(exercises_result), count, start_time)
+        self._cache_test(test_id, user_hash, exercises_result)
         
         return {
             "test_id": test_id,
@@ -144,16 +264,19 @@ class UniversalLernBuddy:
         
         subject, topic, questions_json = old_data[0], old_data[1], old_data[2]
         
-        new_test_id = f"test_{int(time.time())}_{user_hash}"
-        start_time = datetime.utcnow().isoformat()
+        new_test_id = f"test_{next(_TEST_IDS):x}_{user_hash}"
+        start_time = int(time.time())
         
-        self.db.create_test_session(new_test_id, user_hash, subject, topic, questions_json, old_data[4], start_time)
+        # INSERT ... SELECT: die Fragen werden in der DB kopiert, nicht über Python neu geschrieben
+        self.db.clone_test_session(new_test_id, old_test_id, user_hash, start_time)
+        exercises = json_loads(questions_json)
+        self._cache_test(new_test_id, user_hash, exercises)
         
         return {
             "test_id": new_test_id,
             "subject": subject,
             "topic": topic,
-            "exercises": json.loads(questions_json),
+            "exercises": exercises,
             "total_questions": old_data[4],
             "time_limit": 60 * old_data[4],
             "start_time": start_time,
@@ -161,21 +284,51 @@ class UniversalLernBuddy:
         }
 
     def submit_test_answer_multiple(self, username, test_id, question_index, user_answers):
-        # Speichern & KI-Feedback für die einzelne Antwort holen
-        self.save_answer(username, test_id, question_index, user_answers)
-        
-        # Wir brauchen die Frage für das Feedback
+        # Test einmal holen (aus dem Cache, DB nur nach Neustart), dann speichern & Feedback anstoßen
         user_hash = self.db.get_user_hash(username)
-        data = self.db.get_test_session(test_id, user_hash)
-        if not data: return {}
+        cached = self._get_cached_test(test_id, user_hash)
+        if not cached: return {}
+        self._store_answer(test_id, cached, question_index, user_answers)
+        
+        question_data = cached['questions'][question_index]
+        is_correct = frozenset(user_answers) == cached['correct'][question_index]
+        
+        # KI Einzel-Feedback im Hintergrund, Abholung über get_answer_feedback
+        key, answers_key = (test_id, question_index), frozenset(user_answers)
+        _prune_jobs(self._feedback_jobs)
+        job = self._feedback_jobs.get(key)
+        # Gleiche Antwort läuft schon -> keinen zweiten KI-Aufruf starten (Job bleibt an seiner Stelle)
+        if not (job and job[2] == answers_key and not job[1].done()):
+            if job:
+                # Geänderte Antwort: alten Job verwerfen (falls er noch wartet), der neue kommt ans Ende
+                job[1].cancel()
+                del self._feedback_jobs[key]
+            future = self._executor.submit(
+                self._generate_answer_feedback,
+                test_id, user_hash, question_index, question_data, user_answers, is_correct
+            )
+            self._feedback_jobs[key] = (user_hash, future, answers_key, time.monotonic())
+            
+        return {
+            "is_correct": is_correct,
+            "feedback": self._get_fallback_answer_feedback(),
+            "feedback_pending": True
+        }
+
+    def get_answer_feedback(self, username, test_id, question_index):
+        user_hash = self.db.get_user_hash(username)
+        job = self._feedback_jobs.get((test_id, question_index))
+        if not job or job[0] != user_hash: return None
         
-        questions = json.loads(data[2])['exercises']
-        question_data = questions[question_index]
+        future = job[1]
+        if not future.done():
+            return {"ready": False}
+        if future.exception():
+            return {"ready": True, "feedback": self._get_fallback_answer_feedback()}
+        return {"ready": True, "feedback": future.result()}
+
+    def _generate_answer_feedback(self, test_id, user_hash, question_index, question_data, user_answers, is_correct):
         correct = question_data.get('correct_answers', [])
-        
-        is_correct = set(user_answers) == set(correct)
-        
-        # KI Einzel-Feedback
         feedback = self.ai.generate_single_answer_feedback(
             question_data.get('question'),
             str(correct),
@@ -185,71 +338,80 @@ class UniversalLernBuddy:
         
         # Wenn KI failt, Fallback
         if not feedback:
-            feedback = {"strengths": "Antwort gespeichert", "improvements": "", "hint": "", "concept_explanation": ""}
-            
-        return {
-            "is_correct": is_correct,
-            "feedback": feedback
-        }
+            feedback = self._get_fallback_answer_feedback()
+        
+        # Test inzwischen abgeschlossen (nicht mehr im Cache) oder Antwort geändert -> Ergebnis nicht speichern.
+        # Fehlender Job heißt nur "noch nicht eingetragen" (sehr schnelle KI), das ist kein Abbruch
+        job = self._feedback_jobs.get((test_id, question_index))
+        if test_id not in self._test_cache or (job and job[2] != frozenset(user_answers)):
+            return feedback
+        self.db.save_test_result_detail(
+            test_id, user_hash, question_index,
+            json_dumps(user_answers), json_dumps(correct), is_correct, json_dumps(feedback)
+        )
+        return feedback
         
     def save_answer(self, username, test_id, q_index, answers):
         user_hash = self.db.get_user_hash(username)
-        test_data = self.db.get_test_session(test_id, user_hash)
-        if not test_data: return False
-        
-        current_list = json.loads(test_data[3]) if test_data[3] else []
-        new_entry = {'question_index': q_index, 'user_answer': answers, 'timestamp': datetime.now().isoformat()}
+        cached = self._get_cached_test(test_id, user_hash)
+        if not cached: return False
         
-        updated = False
-        for i, item in enumerate(current_list):
-            if item.get('question_index') == q_index:
-                current_list[i] = new_entry
-                updated = True
-                break
-        if not updated: current_list.append(new_entry)
-        
-        self.db.update_test_answer(test_id, json.dumps(current_list))
+        self._store_answer(test_id, cached, q_index, answers)
         return True
 
+    def _store_answer(self, test_id, cached, q_index, answers):
+        # Antworten liegen im Speicher, die DB bekommt nur die eine neue Zeile
+        # O(1) Upsert statt Listen-Suche: Schlüssel ist der Fragen-Index, Zeitstempel in Epoch-ms
+        ts = int(time.time() * 1000)
+        cached['answers'][str(q_index)] = {'question_index': q_index, 'user_answer': answers, 'timestamp': ts}
+        
+        self.db.save_test_answer(test_id, q_index, json_dumps(answers), ts)
+
     def finish_test_session_complete(self, username, test_id):
         user_hash = self.db.get_user_hash(username)
         data = self.db.get_test_session(test_id, user_hash)
         if not data: return {"error": "Test nicht gefunden"}
         
         subject, topic, q_json, a_json, total, start_time, _, _ = data
-        questions = json.loads(q_json).get('exercises', []) if q_json else []
-        user_answers = json.loads(a_json) if a_json else []
-        
-        correct_count = 0
-        detailed = []
-        
-        for i, q in enumerate(questions):
-            u_ans_data = next((a for a in user_answers if a.get('question_index') == i), None)
-            u_list = u_ans_data.get('user_answer', []) if u_ans_data else []
+        cached = self._test_cache.get(test_id)
+        if not cached or cached['user_hash'] != user_hash:
+            cached = self._cache_test(
+                test_id, user_hash,
+                json_loads(q_json) if q_json else {},
+                self._load_answers_map(test_id, a_json)
+            )
+        # Fragen sind schon geparst, Lösungen als frozensets vorberechnet, Antworten = Stand der DB
+        questions, answers_map = cached['questions'], cached['answers']
+        
+        # Ein Durchlauf: Bewertung, Detail-Ansicht und DB-Zeilen zusammen
+        detailed, rows, correct_count = [], [], 0
+        for i, (q, correct) in enumerate(zip(questions, cached['correct'])):
+            u_list = answers_map.get(str(i), {}).get('user_answer', [])
             c_list = q.get('correct_answers', [])
-            
-            is_correct = set(u_list) == set(c_list)
-            if is_correct: correct_count += 1
-            
+            is_correct = frozenset(u_list) == correct
+            correct_count += is_correct
             detailed.append({
                 "question_index": i, "question": q.get('question'), 
                 "user_answers": u_list, "correct_answers": c_list,
                 "is_correct": is_correct, "explanation": q.get('explanation', ''),
                 "options": q.get('options', {}) # Optionen wichtig für Anzeige!
             })
+            rows.append((test_id, user_hash, i, json_dumps(u_list), json_dumps(c_list), 1 if is_correct else 0))
 
         score = (correct_count / total) * 100 if total else 0
         time_spent = self._calculate_time_spent(start_time)
         
         # Speichern
-        self.db.complete_test(test_id, score, correct_count, time_spent, json.dumps(user_answers))
+        self.db.complete_test(test_id, score, correct_count, time_spent, json_dumps(answers_map), rows)
+        self._test_cache.pop(test_id, None)
+        for key in [k for k in self._feedback_jobs if k[0] == test_id]:
+            del self._feedback_jobs[key]
         
-        # KI Gesamtauswertung
-        print(f"🧠 Starte KI-Analyse für {test_id}...")
-        feedback = self.ai.generate_feedback(subject, topic, score, correct_count, total)
-        
-        if not feedback:
-            feedback = self._get_fallback_feedback(score, correct_count, total)
+        # KI Gesamtauswertung läuft im Hintergrund, das Ergebnis kommt sofort mit Fallback-Feedback zurück
+        logger.info("🧠 Starte KI-Analyse für %s...", test_id)
+        _prune_jobs(self._test_feedback_jobs)
+        future = self._executor.submit(self.ai.generate_feedback, subject, topic, score, correct_count, total)
+        self._test_feedback_jobs[test_id] = (user_hash, future, (score, correct_count, total), time.monotonic())
         
         return {
             "test_id": test_id, "score": round(score, 1), 
@@ -257,64 +419,134 @@ class UniversalLernBuddy:
             "time_spent_seconds": time_spent,
             "performance_level": self._get_performance_level(score),
             "subject": subject, "topic": topic,
-            "comprehensive_feedback": feedback,
+            "comprehensive_feedback": self._get_fallback_feedback(score, correct_count, total),
+            "feedback_pending": True,
             "detailed_answers": detailed
         }
 
+    def get_test_feedback(self, username, test_id):
+        user_hash = self.db.get_user_hash(username)
+        job = self._test_feedback_jobs.get(test_id)
+        if not job or job[0] != user_hash: return None
+        
+        # Ergebnis bleibt bis _JOB_TTL abrufbar (Reload / zweiter Poll), aufgeräumt wird beim nächsten Testende
+        _, future, stats, _ = job
+        if not future.done():
+            return {"ready": False}
+        feedback = None if future.exception() else future.result()
+        return {"ready": True, "feedback": feedback or self._get_fallback_feedback(*stats)}
+
     # === HELFER & FALLBACKS ===
     
+    def _clean_exercises(self, data):
+        """Prüft die KI-Antwort einmal bei der Generierung, danach kann man sich auf die Struktur verlassen.
+        Kaputte Aufgaben fallen einzeln raus; None nur, wenn keine brauchbare übrig bleibt"""
+        if not isinstance(data, dict): return None
+        exercises = data.get('exercises')
+        if not isinstance(exercises, list): return None
+        valid = []
+        for ex in exercises:
+            if not isinstance(ex, dict) or not isinstance(ex.get('options'), dict): continue
+            correct = ex.get('correct_answers')
+            # Einzelne Lösung als String ("A") ist gültig -> zur Liste machen
+            if isinstance(correct, str):
+                ex['correct_answers'] = correct = [correct]
+            if not isinstance(correct, list) or not all(isinstance(c, str) for c in correct): continue
+            valid.append(ex)
+        if not valid: return None
+        data['exercises'] = valid
+        return data
+
+    def _cache_test(self, test_id, user_hash, exercises, answers=None):
+        """Legt Fragen, Lösungen (als frozensets) und bisherige Antworten im Speicher ab"""
+        questions = exercises.get('exercises', []) if exercises else []
+        entry = {
+            "user_hash": user_hash,
+            "questions": questions,
+            "correct": [frozenset(q.get('correct_answers', [])) for q in questions],
+            "answers": answers if answers is not None else {}
+        }
+        if test_id not in self._test_cache and len(self._test_cache) >= _TEST_CACHE_MAX:
+            # Ältesten Eintrag verwerfen (dict behält die Einfügereihenfolge), ein Miss lädt ihn aus der DB nach
+            del self._test_cache[next(iter(self._test_cache))]
+        self._test_cache[test_id] = entry
+        return entry
+
+    def _get_cached_test(self, test_id, user_hash):
+        """Holt einen Test aus dem Cache, bei Cache-Miss (z.B. Neustart) aus der DB"""
+        cached = self._test_cache.get(test_id)
+        if cached and cached["user_hash"] == user_hash:
+            return cached
+        data = self.db.get_test_session(test_id, user_hash)
+        if not data: return None
+        return self._cache_test(
+            test_id, user_hash,
+            json_loads(data[2]) if data[2] else {},
+            self._load_answers_map(test_id, data[3])
+        )
+
+    def _load_answers_map(self, test_id, a_json):
+        """Antworten als Dict {"<question_index>": eintrag}: JSON-Feld (alte Tests / Abschluss-Snapshot),
+        darüber die Zeilen aus test_answers (neuere Antwort pro Frage gewinnt)"""
+        answers = {}
+        if a_json:
+            data = json_loads(a_json)
+            answers = {str(a.get('question_index')): a for a in data} if isinstance(data, list) else data
+        for idx, ans, ts in self.db.get_test_answers(test_id):
+            answers[str(idx)] = {'question_index': idx, 'user_answer': json_loads(ans), 'timestamp': ts}
+        return answers
+
     def _calculate_time_spent(self, start_time):
+        # start_time ist Epoch-Sekunden -> reine Integer-Subtraktion, kein Parsen
+        if isinstance(start_time, int):
+            return int(time.time()) - start_time
+        # Alt-Tests von vor der Umstellung haben noch utcnow().isoformat()-Strings
         try:
-            if isinstance(start_time, str):
-                start = datetime.fromisoformat(start_time)
-            else:
-                start = start_time
-            return int((datetime.utcnow() - start).total_seconds())
-        except:
+            return int((datetime.utcnow() - datetime.fromisoformat(start_time)).total_seconds())
+        except (TypeError, ValueError):
             return 0
 
     def _get_performance_level(self, score):
-        if score >= 90: return "Exzellent"
-        if score >= 60: return "Gut"
-        return "Braucht Übung"
+        return _LEVELS[bisect_right(_LEVEL_THRESHOLDS, score)]
 
     def _get_mc_multiple_fallback_exercises(self, subject, topic, count):
-        # Einfaches Fallback, damit der Test nicht abstürzt
+        # Einfaches Fallback, damit der Test nicht abstürzt.
+        # Eigene dicts pro Aufgabe ([x] * count wären count Verweise auf dasselbe Objekt),
+        # Optionen/Lösungen kopiert, damit niemand die Modul-Vorlage verändern kann
+        question = _FALLBACK_QUESTION.format(topic=topic)
         return {
-            "exercises": [{
-                "question": f"Beispielfrage zu {topic} (KI nicht erreichbar)",
-                "options": {"A": "Option 1", "B": "Option 2"},
-                "correct_answers": ["A"],
-                "explanation": "Dies ist ein Platzhalter.",
-                "difficulty": "mittel",
-                "multiple_correct": False
-            }] * count,
-            "adaptive_tips": ["Verbindung zur KI prüfen"]
+            "exercises": [
+                {
+                    "question": question, **_FALLBACK_EXERCISE,
+                    "options": dict(_FALLBACK_EXERCISE["options"]),
+                    "correct_answers": list(_FALLBACK_EXERCISE["correct_answers"])
+                }
+                for _ in range(count)
+            ],
+            "adaptive_tips": list(_FALLBACK_TIPS)
         }
     
+    def _get_fallback_answer_feedback(self):
+        return {"strengths": "Antwort gespeichert", "improvements": "", "hint": "", "concept_explanation": ""}
+
     def _get_fallback_feedback(self, score, correct, total):
-        return {
-            "overall_assessment": f"Test beendet! {correct}/{total} Punkte.",
-            "key_strengths": ["Durchgehalten"],
-            "main_weaknesses": [],
-            "learning_recommendations": [],
-            "conceptual_understanding": "Nicht bewertbar",
-            "next_steps": ["Weiterüben"],
-            "encouragement": "Dranbleiben! 💪"
-        }
+        return {"overall_assessment": f"Test beendet! {correct}/{total} Punkte.", **_FALLBACK_FEEDBACK}
     
     def get_test_history(self, username, limit=10):
         user_hash = self.db.get_user_hash(username)
-        raw_history = self.db.get_test_history(user_hash, limit)
-        history = []
-        for h in raw_history:
-            history.append({
-                "test_id": h[0], "subject": h[1], "topic": h[2], "score": h[3],
-                "correct_answers": h[4], "total_questions": h[5],
-                "time_spent_seconds": h[6], "date": h[8] or h[7],
-                "performance_level": self._get_performance_level(h[3] or 0)
-            })
-        return history
+        get_level = self._get_performance_level
+        return [
+            {
+                "test_id": test_id, "subject": subject, "topic": topic, "score": score,
+                "correct_answers": correct, "total_questions": total,
+                "time_spent_seconds": spent,
+                # Epoch-Start nur formatieren, falls (ausnahmsweise) kein end_time gesetzt ist
+                "date": end or (datetime.fromtimestamp(start).isoformat() if isinstance(start, int) else start),
+                "performance_level": get_level(score or 0)
+            }
+            for test_id, subject, topic, score, correct, total, spent, start, end
+            in self.db.get_test_history(user_hash, limit)
+        ]
     
     def submit_test_answer(self, u, t, q, a): return self.save_answer(u, t, q, a)
 
@@ -323,43 +555,20 @@ class UniversalLernBuddy:
     def get_knowledge_graph_data(self, username):
         user_hash = self.db.get_user_hash(username)
         
-        # 1. Daten holen
-        test_data = self.db.get_subject_averages(user_hash)     # [(Mathe, 80.5, 5), ...]
-        card_data = self.db.get_flashcard_counts(user_hash)     # [(Mathe, 3), ...]
-        
-        # 2. Daten zusammenführen (Dictionary für schnellen Zugriff)
-        subjects = {}
-        
-        # Erst Testergebnisse verarbeiten
-        for row in test_data:
-            subj, score, count = row
-            subjects[subj] = {
-                "score": score, 
-                "test_count": count, 
-                "card_count": 0
-            }
-            
-        # Dann Flashcards dazuaddieren
-        for row in card_data:
-            subj, count = row
-            if subj not in subjects:
-                # Fach existiert nur als Karteikarte (noch kein Test gemacht)
-                subjects[subj] = {"score": 0, "test_count": 0, "card_count": count}
-            else:
-                subjects[subj]["card_count"] = count
+        # 1. Daten holen: Tests und Lern-Sets pro Fach schon in der DB zusammengeführt
+        rows = self.db.get_subject_graph_rows(user_hash)     # [(Mathe, 80.5, 5, 3), ...]
+        scores = {row[0]: row[1] for row in rows}
 
-        # 3. Nodes erstellen
+        # 2. Nodes erstellen
         nodes = []
-        for subj, data in subjects.items():
-            score = data["score"]
-            total_activity = data["test_count"] + data["card_count"]
+        for subj, score, test_count, card_count in rows:
+            total_activity = test_count + card_count
             
             # Farbe basiert NUR auf Test-Score (Leistung)
-            if data["test_count"] == 0:
+            if test_count == 0:
                 color = "#6c757d" # Grau (nur gelernt, nie getestet)
-            elif score >= 80: color = "#28a745" # Grün
-            elif score >= 50: color = "#ffc107" # Gelb
-            else: color = "#dc3545" # Rot
+            else:
+                color = _COLORS[bisect_right(_COLOR_THRESHOLDS, score)]
             
             # Größe basiert auf Aktivität (Tests + Flashcards)
             # Basisgröße 20 + 5 pro Aktivität (max 60)
@@ -367,41 +576,24 @@ class UniversalLernBuddy:
 
             nodes.append({
                 "id": subj,
-                "label": f"{subj}\n({int(score)}%)" if data["test_count"] > 0 else f"{subj}\n(Lernen)",
+                "label": f"{subj}\n({int(score)}%)" if test_count > 0 else f"{subj}\n(Lernen)",
                 "value": size,  # Hier wirkt sich das Flashcard-Lernen aus!
                 "color": color,
-                "title": f"{data['test_count']} Tests, {data['card_count']} Lern-Sets" # Tooltip
+                "title": f"{test_count} Tests, {card_count} Lern-Sets" # Tooltip
             })
 
-        # 4. Edges definieren (Logische Verbindungen bleiben gleich)
-        defined_connections = [
-            ("Mathe", "Physik"), ("Mathe", "Informatik"), ("Mathe", "Chemie"),
-            ("Physik", "Chemie"), ("Biologie", "Chemie"),
-            ("Deutsch", "Englisch"), ("Englisch", "Französisch"), ("Englisch", "Latein"),
-            ("Geschichte", "Politik"), ("Geschichte", "Deutsch"),
-            ("Wirtschaft", "Mathe"), ("Wirtschaft", "Politik"),
-            ("Geografie", "Wirtschaft"), ("Biologie", "Geografie")
+        # 3. Edges definieren (Logische Verbindungen bleiben gleich)
+        # Linie nur, wenn beide Fächer existieren; dick bei guten Noten, dünn bei reinen Lernfächern
+        edges = [
+            {
+                "from": source, 
+                "to": target,
+                "width": (scores[source] + scores[target]) / 40 if scores[source] > 0 and scores[target] > 0 else 1,
+                "color": _EDGE_COLOR
+            }
+            for source, target in _SUBJECT_CONNECTIONS
+            if source in scores and target in scores
         ]
-        
-        edges = []
-        for source, target in defined_connections:
-            if source in subjects and target in subjects:
-                # Wenn beide Fächer existieren, Linie zeichnen
-                s1 = subjects[source]["score"]
-                s2 = subjects[target]["score"]
-                
-                # Dicke der Linie (Nur wenn Tests da sind, sonst dünn)
-                if s1 > 0 and s2 > 0:
-                    width = (s1 + s2) / 40 # Dicke Linie bei guten Noten
-                else:
-                    width = 1 # Dünne Linie bei reinen Lernfächern
-                    
-                edges.append({
-                    "from": source, 
-                    "to": target,
-                    "width": width,
-                    "color": {"color": "#999", "opacity": 0.4}
-                })
 
         return {"nodes": nodes, "edges": edges}
 
@@ -409,7 +601,7 @@ class UniversalLernBuddy:
 
     def start_flashcard_session(self, username, subject, topic, count=10):
         user_hash = self.db.get_user_hash(username)
-        print(f"🃏 Generiere Karteikarten für {subject}...")
+        logger.info("🃏 Generiere Karteikarten für %s...", subject)
         
         # KI Generierung
         cards_data = self.ai.generate_flashcards(subject, topic, count)
@@ -435,7 +627,7 @@ class UniversalLernBuddy:
         return [
             {
                 "id": h[0], "subject": h[1], "topic": h[2], 
-                "card_count": len(json.loads(h[3])), 
+                "card_count": h[3], 
                 "date": h[4]
             } 
             for h in history
@@ -447,7 +639,7 @@ class UniversalLernBuddy:
         if res:
             return {
                 "id": set_id, "subject": res[0], "topic": res[1], 
-                "cards": json.loads(res[2])
+                "cards": json_loads(res[2])
             }
         return None
 
@@ -458,15 +650,16 @@ class UniversalLernBuddy:
         
         # Tage berechnen
         try:
-            exam_date = datetime.strptime(exam_date_str, "%Y-%m-%d")
+            # fromisoformat ist der schnelle C-Pfad für "YYYY-MM-DD" (strptime baut das Format jedes Mal neu)
+            exam_date = datetime.fromisoformat(exam_date_str)
             today = datetime.now()
             days_left = (exam_date - today).days + 1
             
             if days_left <= 0: return {"error": "Das Datum liegt in der Vergangenheit!"}
             if days_left > 60: return {"error": "Plan maximal für 60 Tage möglich."}
-        except: return {"error": "Ungültiges Datum"}
+        except (TypeError, ValueError): return {"error": "Ungültiges Datum"}
 
-        print(f"📅 Generiere Plan für {subject} ({days_left} Tage)...")
+        logger.info("📅 Generiere Plan für %s (%s Tage)...", subject, days_left)
         
         # KI fragen
         ai_res = self.ai.generate_study_plan(subject, days_left)
@@ -481,7 +674,7 @@ class UniversalLernBuddy:
         user_hash = self.db.get_user_hash(username)
         raw = self.db.get_study_plans(user_hash)
         return [
-            {"id": r[0], "subject": r[1], "exam_date": r[2], "plan": json.loads(r[3])}
+            {"id": r[0], "subject": r[1], "exam_date": r[2], "plan": json_loads(r[3])}
             for r in raw
         ]
         
@@ -226,7 +226,10 @@ async function finishTest() {
 
     try {
         const result = await apiCall('/api/finish-test', 'POST', { test_id: currentTest.test_id });
-        if(result.success) renderResults(result.data);
+        if(result.success) {
+            renderResults(result.data);
+            if(result.data.feedback_pending) pollTestFeedback(result.data.test_id, result.data.comprehensive_feedback);
+        }
     } catch(e) {
         showOutput("Fehler bei Auswertung", "error-msg");
     }
@@ -264,8 +267,8 @@ function renderResults(data) {
 
             <div class="feedback-section" style="margin-bottom: 40px; background: #f8faff; border-radius: 16px; padding: 5px; border: 1px solid #e2e8f0;">
                 <h3 style="margin: 20px 0 15px 25px; color: #5a67d8;">🚀 Coach-Feedback</h3>
-                <div class="feedback-container">
-                    ${renderAiFeedback(data.comprehensive_feedback)}
+                <div class="feedback-container" id="testFeedbackContainer">
+                    ${data.feedback_pending ? renderFeedbackPending() : renderAiFeedback(data.comprehensive_feedback)}
                 </div>
             </div>
 
@@ -291,6 +294,37 @@ function renderResults(data) {
     renderMath(container);
 }
 
+// KI-Gesamtauswertung wird im Hintergrund erzeugt und nachgeladen.
+// Abfrage mit wachsendem Abstand (1.5s bis 10s), bis sie fertig ist; erst nach ~5 Minuten
+// oder wenn der Server den Job nicht mehr kennt, bleibt das Standard-Feedback stehen
+function renderFeedbackPending() {
+    return `
+        <div style="text-align:center; padding:20px;">
+            <div class="spinning" style="font-size:2rem">🧠</div>
+            <p>KI-Auswertung wird erstellt…</p>
+        </div>
+    `;
+}
+
+async function pollTestFeedback(testId, fallbackFeedback, attempt = 0, waitedMs = 0) {
+    const container = document.getElementById('testFeedbackContainer');
+    const show = (fb) => {
+        if(!container) return;
+        container.innerHTML = renderAiFeedback(fb);
+        renderMath(container);
+    };
+    try {
+        const result = await apiCall(`/api/test-feedback/${testId}`);
+        if(!result || !result.success) return show(fallbackFeedback);
+        if(result.data.ready) return show(result.data.feedback);
+    } catch(e) {
+        return show(fallbackFeedback);
+    }
+    if(waitedMs >= 300000) return show(fallbackFeedback);
+    const delay = Math.min(1500 * Math.pow(1.5, attempt), 10000);
+    setTimeout(() => pollTestFeedback(testId, fallbackFeedback, attempt + 1, waitedMs + delay), delay);
+}
+
 // === DIESE FUNKTION WAR VEREINFACHT, JETZT WIEDER VOLLSTÄNDIG ===
 function renderAiFeedback(fb) {
     if(!fb) return '<p>Kein Feedback verfügbar.</p>';
@@ -28,6 +28,9 @@ SUBJECTS = {
     "Geografie": ["Klimawandel", "Bevölkerung", "Plattentektonik"]
 }
 
+# Topics-Spalte (JSON-Liste mit einem Thema) einmal pro Thema serialisieren statt pro Zeile
+TOPICS_JSON = {topic: json.dumps([topic]) for topics in SUBJECTS.values() for topic in topics}
+
 def get_user_hash(username):
     return hashlib.sha256(username.encode()).hexdigest()[:16]
 
@@ -35,6 +38,8 @@ def seed_massive():
     print(f"🌋 Starte MASSIVE DATA INJECTION für '{USERNAME}'...")
     
     conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     cursor = conn.cursor()
     
     # 1. User Check
@@ -51,8 +56,9 @@ def seed_massive():
 
     # 3. Massen-Daten generieren
     start_date = datetime.now() - timedelta(days=365) # Ein Jahr Rückblick
-    count_tests = 0
-    count_sessions = 0
+    # Zeilen erst sammeln, am Ende mit executemany in einer Transaktion schreiben
+    study_rows = []
+    test_rows = []
     
     print("🚀 Generiere Daten... (das kann kurz dauern)")
 
@@ -72,14 +78,9 @@ def seed_massive():
             perf_score = random.uniform(score_trend - 0.2, score_trend + 0.1)
             perf_score = max(0.1, min(1.0, perf_score)) # Clamp 0.1 - 1.0
             
-            cursor.execute('''
-                INSERT INTO study_sessions 
-                (user_hash, subject, duration_minutes, topics, performance_score, engagement_level, difficulty_level, session_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user_hash, subj, duration, json.dumps([topic]), perf_score, random.random(), "mittel", current_date.isoformat()
+            study_rows.append((
+                user_hash, subj, duration, TOPICS_JSON[topic], perf_score, random.random(), "mittel", current_date.isoformat()
             ))
-            count_sessions += 1
 
             # 50% Chance, dass nach dem Lernen ein TEST gemacht wurde
             if random.random() < 0.5:
@@ -89,11 +90,7 @@ def seed_massive():
                 test_score = perf_score * 100 + random.randint(-10, 10)
                 test_score = max(10, min(100, test_score)) # Clamp 0-100
                 
-                cursor.execute('''
-                    INSERT INTO test_sessions 
-                    (test_id, user_hash, subject, topic, score, total_questions, correct_answers, status, start_time, end_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
+                test_rows.append((
                     test_id,
                     user_hash,
                     subj,
@@ -102,20 +99,31 @@ def seed_massive():
                     10,
                     int(test_score / 10),
                     'completed',
-                    current_date.isoformat(),
+                    int(current_date.timestamp()),
                     (current_date + timedelta(minutes=20)).isoformat()
                 ))
-                count_tests += 1
         
         # Nächster Tag
         current_date += timedelta(days=1)
 
-    conn.commit()
+    with conn:
+        cursor.executemany('''
+            INSERT INTO study_sessions 
+            (user_hash, subject, duration_minutes, topics, performance_score, engagement_level, difficulty_level, session_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', study_rows)
+        cursor.executemany('''
+            INSERT INTO test_sessions 
+            (test_id, user_hash, subject, topic, score, total_questions, correct_answers, status, start_time, end_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', test_rows)
+    # Statistiken für den Query-Planer nach dem Massen-Import neu erheben (nutzt die Indizes aus database.py)
+    conn.execute("ANALYZE")
     conn.close()
     
     print(f"✅ FERTIG! Datenbank gefüttert mit:")
-    print(f"   - {count_sessions} Lern-Sessions")
-    print(f"   - {count_tests} absolvierten Tests")
+    print(f"   - {len(study_rows)} Lern-Sessions")
+    print(f"   - {len(test_rows)} absolvierten Tests")
     print("👉 Dein Graph sollte jetzt explodieren! 🕸️💥")
 
 if __name__ == "__main__":